@@ -4,22 +4,44 @@
 # GitHub     : https://github.com/QIN2DIM
 # Description: 游戏商城控制句柄
 
-import json
+import asyncio
+import re
+import time
 from contextlib import suppress
 from json import JSONDecodeError
-from typing import List
+from pathlib import Path
+from typing import Dict, List
 
 import httpx
 from hcaptcha_challenger.agent import AgentV
 from loguru import logger
-from playwright.async_api import Page
-from playwright.async_api import expect, TimeoutError, FrameLocator
-from tenacity import retry, retry_if_exception_type, stop_after_attempt
+from playwright.async_api import ElementHandle, Page
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import expect, TimeoutError, FrameLocator, Locator
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 from models import OrderItem, Order
 from models import PromotionGame
 from settings import settings, RUNTIME_DIR
 
+try:
+    import orjson
+
+    loads = orjson.loads
+
+    def dumps(obj, indent: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+
+except ImportError:
+    from json import loads, dumps as _dumps
+
+    def dumps(obj, indent: bool = False) -> bytes:
+        return _dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf8")
+
+
 URL_CLAIM = "https://store.epicgames.com/en-US/free-games"
 URL_LOGIN = (
     f"https://www.epicgames.com/id/login?lang=en-US&noHostRedirect=true&redirectUrl={URL_CLAIM}"
@@ -31,31 +53,112 @@ URL_CART_SUCCESS = "https://store.epicgames.com/en-US/cart/success"
 URL_PROMOTIONS = "https://store-site-backend-static.ak.epicgames.com/freeGamesPromotions"
 URL_PRODUCT_PAGE = "https://store.epicgames.com/en-US/p/"
 URL_PRODUCT_BUNDLES = "https://store.epicgames.com/en-US/bundles/"
+URL_ORDER_HISTORY = "https://www.epicgames.com/account/v2/payment/ajaxGetOrderHistory"
+URL_PURCHASE_ORIGIN = "https://www.epicgames.com/"
+
+_PAGE_BASE = URL_PRODUCT_PAGE.rstrip("/")
+_BUNDLE_BASE = URL_PRODUCT_BUNDLES.rstrip("/")
+
+# 页面元素选择器，尽量使用 CSS 引擎而不是 XPath
+PURCHASE_BTN = "button[data-testid='purchase-cta-button']"
+CONTINUE_BTN = "button span:text-is('Continue')"
+CHECKOUT_BTN = "button span:text-is('Check Out')"
+ACCEPT_BTN = "button span:text-is('Accept')"
+AGREE_LABEL = "label[for='agree']"
+MOVE_WISHLIST = "button span:text-is('Move to wishlist')"
+FREE_SPAN = "span:text-is('Free')"
+OFFER_CARD = "div[data-testid='offer-card-layout-wrapper']"
+IFRAME_SEL = "iframe[id*='webPurchaseContainer'], iframe[src*='purchase']"
+PAYMENT_CONFIRM_BTN = "button[class*='payment-confirm__btn']"
+HCAPTCHA_CHALLENGE = (
+    "iframe[src^='https://newassets.hcaptcha.com/captcha/v1/'][src*='frame=challenge']"
+)
+
+RE_OWNED = re.compile(r"In Library|Owned")
+
+JS_PRECONNECT = """(origins) => {
+    for (const o of origins) {
+        fetch(o, {method: 'HEAD', mode: 'no-cors', credentials: 'include'}).catch(() => {});
+    }
+}"""
+
+# 只把模型需要的字段交给 Pydantic，其余图片、标签、卖家等元数据不参与校验
+PROMOTION_FIELDS = frozenset(PromotionGame.model_fields)
+
+ORDERS_CACHE_TTL = 24 * 60 * 60
+
+_CLIENT: httpx.AsyncClient | None = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """在一次拉取（含重试）内复用 HTTP/2 连接，用完由 close_client 关闭"""
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_keepalive_connections=4),
+        )
+    return _CLIENT
+
+
+async def close_client():
+    """关闭连接池，避免其绑定的事件循环结束后（如 Celery 每次 asyncio.run）连接泄漏"""
+    global _CLIENT
+    if _CLIENT is not None:
+        client, _CLIENT = _CLIENT, None
+        await client.aclose()
+
+
+@retry(
+    retry=retry_if_exception_type(httpx.HTTPError),
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(),
+    reraise=True,
+)
+async def _fetch_promotions() -> httpx.Response:
+    resp = await _get_client().get(URL_PROMOTIONS, params={"local": "zh-CN"})
+    resp.raise_for_status()
+    return resp
+
+
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+
+def _on_background_task_done(task: asyncio.Task):
+    _BACKGROUND_TASKS.discard(task)
+    if not task.cancelled() and (err := task.exception()):
+        logger.debug(f"Background task failed - {err!r}")
+
 
+def _write_promotions_cache(data: dict):
+    cache_key = RUNTIME_DIR.joinpath("promotions.json")
+    cache_key.parent.mkdir(parents=True, exist_ok=True)
+    cache_key.write_bytes(dumps(data, indent=True))
 
-def get_promotions() -> List[PromotionGame]:
+
+async def get_promotions() -> List[PromotionGame]:
     """获取周免游戏数据"""
-    def is_discount_game(prot: dict) -> bool | None:
-        with suppress(KeyError, IndexError, TypeError):
-            offers = prot["promotions"]["promotionalOffers"][0]["promotionalOffers"]
-            for i, offer in enumerate(offers):
-                if offer["discountSetting"]["discountPercentage"] == 0:
-                    return True
+    def is_discount_game(prot: dict) -> bool:
+        promotional_offers = (prot.get("promotions") or {}).get("promotionalOffers") or [{}]
+        offers = promotional_offers[0].get("promotionalOffers") or ()
+        return any(
+            (offer.get("discountSetting") or {}).get("discountPercentage") == 0 for offer in offers
+        )
 
     promotions: List[PromotionGame] = []
 
-    resp = httpx.get(URL_PROMOTIONS, params={"local": "zh-CN"})
-
     try:
-        data = resp.json()
-    except JSONDecodeError as err:
+        resp = await _fetch_promotions()
+        data = loads(resp.content)
+    except (httpx.HTTPError, JSONDecodeError) as err:
         logger.error("Failed to get promotions", err=err)
         return []
 
-    with suppress(Exception):
-        cache_key = RUNTIME_DIR.joinpath("promotions.json")
-        cache_key.parent.mkdir(parents=True, exist_ok=True)
-        cache_key.write_text(json.dumps(data, indent=2, ensure_ascii=False))
+    # 缓存写盘放到线程中执行，不阻塞后续解析
+    task = asyncio.create_task(asyncio.to_thread(_write_promotions_cache, data))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_on_background_task_done)
 
     # Get store promotion data and <this week free> games
     for e in data["data"]["Catalog"]["searchStore"]["elements"]:
@@ -65,35 +168,35 @@ def get_promotions() -> List[PromotionGame]:
         # -----------------------------------------------------------
         # 🟢 智能 URL 识别逻辑
         # -----------------------------------------------------------
-        is_bundle = False
-        if e.get("offerType") == "BUNDLE":
-            is_bundle = True
-        
-        # 补充检测：分类和标题
-        if not is_bundle:
-            for cat in e.get("categories", []):
-                if "bundle" in cat.get("path", "").lower():
-                    is_bundle = True
-                    break
-        if not is_bundle and "Collection" in e.get("title", ""):
-             is_bundle = True
-
-        base_url = URL_PRODUCT_BUNDLES if is_bundle else URL_PRODUCT_PAGE
-
-        try:
-            if e.get('offerMappings'):
-                slug = e['offerMappings'][0]['pageSlug']
-                e["url"] = f"{base_url.rstrip('/')}/{slug}"
-            elif e.get("productSlug"):
-                e["url"] = f"{base_url.rstrip('/')}/{e['productSlug']}"
-            else:
-                 e["url"] = f"{base_url.rstrip('/')}/{e.get('urlSlug', 'unknown')}"
-        except (KeyError, IndexError):
+        # 依次检测：商品类型、分类路径、标题
+        is_bundle = (
+            e.get("offerType") == "BUNDLE"
+            or any("bundle" in (c.get("path") or "").lower() for c in e.get("categories") or ())
+            or "Collection" in (e.get("title") or "")
+        )
+
+        offer_mappings = e.get("offerMappings") or ()
+        slug = (
+            (offer_mappings[0].get("pageSlug") if offer_mappings else None)
+            or e.get("productSlug")
+            or e.get("urlSlug")
+        )
+        if not slug:
             logger.info(f"Failed to get URL: {e}")
             continue
-
-        logger.info(e["url"])
-        promotions.append(PromotionGame(**e))
+        url = f"{_BUNDLE_BASE if is_bundle else _PAGE_BASE}/{slug}"
+
+        logger.info(url)
+        # 不回写原始元素：缓存线程正在读取同一份 data
+        fields = {k: e[k] for k in PROMOTION_FIELDS if k in e}
+        fields["url"] = url
+        # 字段齐全且均为字符串时跳过 Pydantic 校验，否则走完整校验
+        if len(fields) == len(PROMOTION_FIELDS) and all(
+            isinstance(v, str) for v in fields.values()
+        ):
+            promotions.append(PromotionGame.model_construct(**fields))
+        else:
+            promotions.append(PromotionGame(**fields))
 
     return promotions
 
@@ -104,18 +207,45 @@ class EpicAgent:
         self.epic_games = EpicGames(self.page)
         self._promotions: List[PromotionGame] = []
         self._ctx_cookies_is_available: bool = False
-        self._orders: List[OrderItem] = []
-        self._namespaces: List[str] = []
+        self._orders_by_ns: Dict[str, OrderItem] = {}
         self._cookies = None
 
+    @property
+    def _orders_cache(self) -> Path:
+        return RUNTIME_DIR.joinpath("orders", f"{settings.EPIC_EMAIL}.json")
+
+    def _load_orders_cache(self) -> Dict[str, OrderItem]:
+        with suppress(Exception):
+            cache = self._orders_cache
+            if time.time() - cache.stat().st_mtime < ORDERS_CACHE_TTL:
+                items = (OrderItem(**item) for item in loads(cache.read_bytes()))
+                return {item.namespace: item for item in items}
+        return {}
+
+    def _save_orders_cache(self):
+        with suppress(Exception):
+            cache = self._orders_cache
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            cache.write_bytes(dumps([item.model_dump() for item in self._orders_by_ns.values()]))
+
+    @retry(retry=retry_if_exception_type(httpx.HTTPError), stop=stop_after_attempt(3), reraise=True)
+    async def _fetch_order_history(self) -> dict:
+        """复用浏览器上下文的登录态，直接请求订单历史接口"""
+        cookies = await self.page.context.cookies("https://www.epicgames.com")
+        headers = {"User-Agent": await self.page.evaluate("() => navigator.userAgent")}
+        async with httpx.AsyncClient(
+            cookies={c["name"]: c["value"] for c in cookies}, headers=headers, http2=True
+        ) as client:
+            resp = await client.get(URL_ORDER_HISTORY)
+            resp.raise_for_status()
+            return loads(resp.content)
+
     async def _sync_order_history(self):
-        if self._orders:
+        if self._orders_by_ns:
             return
-        completed_orders: List[OrderItem] = []
+        orders_by_ns: Dict[str, OrderItem] = {}
         try:
-            await self.page.goto("https://www.epicgames.com/account/v2/payment/ajaxGetOrderHistory")
-            text_content = await self.page.text_content("//pre")
-            data = json.loads(text_content)
+            data = await self._fetch_order_history()
             for _order in data["orders"]:
                 order = Order(**_order)
                 if order.orderType != "PURCHASE":
@@ -123,15 +253,30 @@ class EpicAgent:
                 for item in order.items:
                     if not item.namespace or len(item.namespace) != 32:
                         continue
-                    completed_orders.append(item)
+                    orders_by_ns[item.namespace] = item
         except Exception as err:
             logger.warning(err)
-        self._orders = completed_orders
+            return
+        # 只有完整解析后才生效，避免残缺的订单历史被写入缓存
+        self._orders_by_ns = orders_by_ns
 
     async def _check_orders(self):
-        await self._sync_order_history()
-        self._namespaces = self._namespaces or [order.namespace for order in self._orders]
-        self._promotions = [p for p in get_promotions() if p.namespace not in self._namespaces]
+        self._orders_by_ns = self._orders_by_ns or self._load_orders_cache()
+        if not self._orders_by_ns:
+            await self._sync_order_history()
+            if self._orders_by_ns:
+                self._save_orders_cache()
+        try:
+            promotions = await get_promotions()
+        finally:
+            await close_client()
+        self._promotions = [p for p in promotions if p.namespace not in self._orders_by_ns]
+
+    def _preconnect(self, *origins: str):
+        """在页面内发起不等待结果的 HEAD 请求，预热 DNS 与 TLS 连接"""
+        task = asyncio.create_task(self.page.evaluate(JS_PRECONNECT, list(origins)))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_on_background_task_done)
 
     async def _should_ignore_task(self) -> bool:
         self._ctx_cookies_is_available = False
@@ -141,6 +286,8 @@ class EpicAgent:
             logger.error("❌ context cookies is not available")
             return False
         self._ctx_cookies_is_available = True
+        # 结账 iframe 位于 www.epicgames.com，提前建立连接，与订单/周免数据的拉取并行
+        self._preconnect(URL_PURCHASE_ORIGIN)
         await self._check_orders()
         if not self._promotions:
             return True
@@ -154,23 +301,17 @@ class EpicAgent:
         if not self._ctx_cookies_is_available:
             return
 
-        if not self._promotions:
-            await self._check_orders()
-
-        if not self._promotions:
-            logger.success("All week-free games are already in the library")
-            return
-
         for p in self._promotions:
-            pj = json.dumps({"title": p.title, "url": p.url}, indent=2, ensure_ascii=False)
+            pj = dumps({"title": p.title, "url": p.url}, indent=True).decode("utf8")
             logger.debug(f"Discover promotion \n{pj}")
 
-        if self._promotions:
-            try:
-                await self.epic_games.collect_weekly_games(self._promotions)
-            except Exception as e:
-                logger.exception(e)
-        
+        try:
+            await self.epic_games.collect_weekly_games(self._promotions)
+        except Exception as e:
+            logger.exception(e)
+        # 库存已变化，下次运行重新同步订单历史
+        self._orders_cache.unlink(missing_ok=True)
+
         logger.debug("All tasks in the workflow have been completed")
 
 
@@ -178,60 +319,112 @@ class EpicGames:
     def __init__(self, page: Page):
         self.page = page
         self._promotions: List[PromotionGame] = []
+        self._agents: Dict[Page, AgentV] = {}
+
+    def _get_agent(self, page: Page) -> AgentV:
+        """每次结账开始时调用；AgentV 会在 page 上挂载监听器，因此按页面复用"""
+        if (agent := self._agents.get(page)) is None:
+            agent = AgentV(page=page, agent_config=settings)
+            self._agents[page] = agent
+            return agent
+
+        # 清掉上一次结账遗留的挑战数据，否则 wait_for_challenge 会把旧的
+        # checkcaptcha 响应当作本次结果直接返回，或用旧题目去解新的挑战
+        agent._captcha_payload = None
+        for queue in (agent._captcha_payload_queue, agent._captcha_response_queue):
+            while not queue.empty():
+                queue.get_nowait()
+        return agent
 
     @staticmethod
     async def _agree_license(page: Page):
         logger.debug("Agree license")
         with suppress(TimeoutError):
-            await page.click("//label[@for='agree']", timeout=4000)
-            accept = page.locator("//button//span[text()='Accept']")
+            await page.click(AGREE_LABEL, timeout=4000)
+            accept = page.locator(ACCEPT_BTN)
             if await accept.is_enabled():
                 await accept.click()
 
     @staticmethod
     async def _active_purchase_container(page: Page):
         logger.debug("Scanning for purchase iframe...")
-        iframe_selector = "//iframe[contains(@id, 'webPurchaseContainer') or contains(@src, 'purchase')]"
-        wpc = page.frame_locator(iframe_selector).first
+        wpc = page.frame_locator(IFRAME_SEL).first
 
         logger.debug("Looking for 'PLACE ORDER' button...")
         place_order_btn = wpc.locator("button", has_text="PLACE ORDER")
-        confirm_btn = wpc.locator("//button[contains(@class, 'payment-confirm__btn')]")
-        
-        try:
-            await expect(place_order_btn).to_be_visible(timeout=15000)
-            logger.debug("✅ Found 'PLACE ORDER' button via text match")
-            return wpc, place_order_btn
-        except AssertionError:
-            pass
-            
+        confirm_btn = wpc.locator(PAYMENT_CONFIRM_BTN)
+
+        async def _wait_visible(locator: Locator, hint: str) -> Locator:
+            await expect(locator).to_be_visible(timeout=15000)
+            logger.debug(f"✅ Found button via {hint}")
+            return locator
+
+        # 两种按钮任一出现即可，同时等待而不是依次超时
+        pending = {
+            asyncio.create_task(_wait_visible(place_order_btn, "text match")),
+            asyncio.create_task(_wait_visible(confirm_btn, "CSS class match")),
+        }
         try:
-            await expect(confirm_btn).to_be_visible(timeout=5000)
-            logger.debug("✅ Found button via CSS class match")
-            return wpc, confirm_btn
-        except AssertionError:
-            logger.warning("Primary buttons not found in iframe.")
-            raise AssertionError("Could not find Place Order button in iframe")
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.exception():
+                        return wpc, task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        logger.warning("Primary buttons not found in iframe.")
+        raise AssertionError("Could not find Place Order button in iframe")
 
     @staticmethod
     async def _uk_confirm_order(wpc: FrameLocator):
         logger.debug("UK confirm order")
         with suppress(TimeoutError):
-            accept = wpc.locator("//button[contains(@class, 'payment-confirm__btn')]")
+            accept = wpc.locator(PAYMENT_CONFIRM_BTN)
             if await accept.is_enabled(timeout=5000):
                 await accept.click()
                 return True
 
+    @staticmethod
+    async def _wait_checkout_outcome(page: Page, wpc: FrameLocator, timeout: int = 8000) -> bool:
+        """等待结账 iframe 关闭或人机验证弹出，以先发生者为准；仅前者返回 True"""
+        iframe_closed = asyncio.create_task(
+            expect(page.locator(IFRAME_SEL)).to_have_count(0, timeout=timeout)
+        )
+        # 挑战框可能挂在顶层页面，也可能嵌在结账 iframe 内
+        challenge_shown = {
+            asyncio.create_task(
+                expect(frame.locator(HCAPTCHA_CHALLENGE).first).to_be_visible(timeout=timeout)
+            )
+            for frame in (page, wpc)
+        }
+        pending = {iframe_closed, *challenge_shown}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.exception():
+                        return task is iframe_closed
+        finally:
+            for task in pending:
+                task.cancel()
+        return False
+
     async def _handle_instant_checkout(self, page: Page):
         logger.info("🚀 Triggering Instant Checkout Flow...")
-        agent = AgentV(page=page, agent_config=settings)
+        agent = self._get_agent(page)
 
         try:
             wpc, payment_btn = await self._active_purchase_container(page)
             logger.debug(f"Clicking payment button: {await payment_btn.text_content()}")
             await payment_btn.click(force=True)
-            await page.wait_for_timeout(3000)
-            
+
+            # 结账 iframe 关闭才视为下单成功；按钮文字变化（如加载中）不算，需转入人机验证
+            if await self._wait_checkout_outcome(page, wpc):
+                logger.success("🎉 Instant Checkout: Iframe closed (Success inferred)")
+                return
+
             try:
                 logger.debug("Checking for CAPTCHA...")
                 await agent.wait_for_challenge()
@@ -248,7 +441,8 @@ class EpicGames:
 
             with suppress(Exception):
                 await payment_btn.click(force=True)
-                await page.wait_for_timeout(2000)
+                # 等结账 iframe 关闭再离开页面，避免下一次跳转中断订单
+                await expect(page.locator(IFRAME_SEL)).to_have_count(0, timeout=8000)
             
             logger.success("Instant checkout flow finished (Blind Success).")
 
@@ -256,99 +450,133 @@ class EpicGames:
             logger.warning(f"Instant checkout warning (Game might still be claimed): {err}")
             await page.reload()
 
-    async def add_promotion_to_cart(self, page: Page, urls: List[str]) -> bool:
-        has_pending_cart_items = False
-
-        for url in urls:
-            await page.goto(url, wait_until="load")
+    async def _claim_one(self, page: Page, url: str) -> bool:
+        """领取单个游戏，返回该游戏是否被加入了购物车"""
+        resp = await page.goto(url, wait_until="domcontentloaded", timeout=15000)
 
-            # 404 检测
-            title = await page.title()
-            if "404" in title or "Page Not Found" in title:
-                logger.error(f"❌ Invalid URL (404 Page): {url}")
-                continue
+        # 404 检测：直接看响应状态码，无需等待图片等子资源加载
+        if resp and resp.status >= 400:
+            logger.error(f"❌ Invalid URL (HTTP {resp.status}): {url}")
+            return False
 
-            # 处理年龄限制弹窗
-            try:
-                continue_btn = page.locator("//button//span[text()='Continue']")
-                if await continue_btn.is_visible(timeout=5000):
-                    await continue_btn.click()
-            except Exception:
-                pass 
+        # 以购买按钮（或年龄限制弹窗）出现作为页面可交互的信号
+        with suppress(TimeoutError):
+            ready = page.locator(PURCHASE_BTN).or_(page.locator(CONTINUE_BTN))
+            await ready.first.wait_for(timeout=8000)
 
-            # ------------------------------------------------------------
-            # 🔥 新思路：彻底解决按钮识别问题 (黑名单机制 + 智能点击)
-            # ------------------------------------------------------------
-            
-            # 1. 尝试找到所有可能的“主按钮”
-            # Epic 按钮通常有 'purchase-cta-button' 这个 TestID
-            purchase_btn = page.locator("//button[@data-testid='purchase-cta-button']").first
+        # 处理年龄限制弹窗
+        try:
+            continue_btn = page.locator(CONTINUE_BTN)
+            if await continue_btn.is_visible(timeout=5000):
+                await continue_btn.click()
+        except Exception:
+            pass 
+
+        # ------------------------------------------------------------
+        # 🔥 新思路：彻底解决按钮识别问题 (黑名单机制 + 智能点击)
+        # ------------------------------------------------------------
+        
+        # 1. 尝试找到所有可能的“主按钮”
+        # Epic 按钮通常有 'purchase-cta-button' 这个 TestID
+        purchase_btn = page.locator(PURCHASE_BTN).first
 
-            # 2. 如果没找到主按钮，尝试找“库中”状态
-            try:
-                if not await purchase_btn.is_visible(timeout=5000):
-                    # 再次检查是否在库中 (有时按钮不叫 purchase-cta，而是简单的 disabled button)
-                    all_text = await page.locator("body").text_content()
-                    if "In Library" in all_text or "Owned" in all_text:
-                         logger.success(f"Already in the library (Page Text Scan) - {url=}")
-                         continue
-                    logger.warning(f"Could not find any purchase button - {url=}")
-                    continue
-            except Exception:
-                pass
+        # 2. 如果没找到主按钮，尝试找“库中”状态
+        try:
+            if not await purchase_btn.is_visible(timeout=5000):
+                # 再次检查是否在库中 (有时按钮不叫 purchase-cta，而是简单的 disabled button)
+                # 在浏览器侧匹配文本，避免把整页 DOM 文本传回 Python
+                owned = page.locator("body", has_text=RE_OWNED)
+                if await owned.count():
+                     logger.success(f"Already in the library (Page Text Scan) - {url=}")
+                     return False
+                logger.warning(f"Could not find any purchase button - {url=}")
+                return False
+        except Exception:
+            pass
 
-            # 3. 获取按钮文字
-            btn_text = await purchase_btn.text_content()
-            if not btn_text: btn_text = ""
-            btn_text_upper = btn_text.strip().upper()
-            
-            logger.debug(f"👉 Found Button: '{btn_text}'")
+        # 3. 获取按钮文字
+        btn_text = await purchase_btn.text_content()
+        if not btn_text: btn_text = ""
+        btn_text_upper = btn_text.strip().upper()
+        
+        logger.debug(f"👉 Found Button: '{btn_text}'")
 
-            # 4. 黑名单检查：只有这些情况绝对不能点
-            # 如果是 'IN LIBRARY', 'OWNED', 'UNAVAILABLE', 'COMING SOON' -> 跳过
-            if any(s in btn_text_upper for s in ["IN LIBRARY", "OWNED", "UNAVAILABLE", "COMING SOON"]):
-                logger.success(f"Game status is '{btn_text}' - Skipping.")
-                continue
+        # 4. 黑名单检查：只有这些情况绝对不能点
+        # 如果是 'IN LIBRARY', 'OWNED', 'UNAVAILABLE', 'COMING SOON' -> 跳过
+        if any(s in btn_text_upper for s in ["IN LIBRARY", "OWNED", "UNAVAILABLE", "COMING SOON"]):
+            logger.success(f"Game status is '{btn_text}' - Skipping.")
+            return False
 
-            # 5. 白名单检查 (Add to Cart 特殊处理)
-            # 如果包含 'CART'，说明是加入购物车流程
-            if "CART" in btn_text_upper:
-                logger.debug(f"🛒 Logic: Add To Cart - {url=}")
-                await purchase_btn.click()
-                has_pending_cart_items = True
-                continue
-            
-            # 6. 默认处理 (盲点逻辑)
-            # 只要不是黑名单，也不是购物车，统统当做 "Get/Purchase" 直接点击！
-            # 不管它写的是 'Get', 'Free', 'Purchase', 'Buy Now'，只要 API 说是免费的，我们就点！
-            logger.debug(f"⚡️ Logic: Aggressive Click (Text: {btn_text}) - {url=}")
+        # 5. 白名单检查 (Add to Cart 特殊处理)
+        # 如果包含 'CART'，说明是加入购物车流程
+        if "CART" in btn_text_upper:
+            logger.debug(f"🛒 Logic: Add To Cart - {url=}")
             await purchase_btn.click()
-            
-            # 点击后，转入即时结账流程
-            await self._handle_instant_checkout(page)
-            # ------------------------------------------------------------
+            return True
+        
+        # 6. 默认处理 (盲点逻辑)
+        # 只要不是黑名单，也不是购物车，统统当做 "Get/Purchase" 直接点击！
+        # 不管它写的是 'Get', 'Free', 'Purchase', 'Buy Now'，只要 API 说是免费的，我们就点！
+        logger.debug(f"⚡️ Logic: Aggressive Click (Text: {btn_text}) - {url=}")
+        await purchase_btn.click()
+        
+        # 点击后，转入即时结账流程
+        await self._handle_instant_checkout(page)
+        # ------------------------------------------------------------
+        return False
+
+    async def add_promotion_to_cart(self, page: Page, urls: List[str]) -> bool:
+        if len(urls) <= 1 or settings.PARALLEL_CLAIMS <= 1:
+            results = [await self._claim_one(page, url) for url in urls]
+            return any(results)
+
+        # 持久化上下文共享登录态，每个 URL 在同一上下文中开一个新标签页并发领取
+        # 加购只是点击按钮，购物车结账仍在全部领取结束后由 _purchase_free_game 串行完成
+        sem = asyncio.Semaphore(settings.PARALLEL_CLAIMS)
+
+        async def _worker(url: str) -> bool:
+            async with sem:
+                worker_page = await page.context.new_page()
+                try:
+                    return await self._claim_one(worker_page, url)
+                finally:
+                    self._agents.pop(worker_page, None)
+                    with suppress(Exception):
+                        await worker_page.close()
+
+        results = await asyncio.gather(*[_worker(url) for url in urls], return_exceptions=True)
+
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for url, r in zip(urls, results):
+            if isinstance(r, BaseException):
+                logger.warning(f"Failed to claim game - {url=} err={r!r}")
+        if errors:
+            raise errors[0]
+
+        return any(results)
 
-        return has_pending_cart_items
+    @staticmethod
+    async def _find_paid_wishlist_btn(page: Page) -> ElementHandle | None:
+        for card in await page.query_selector_all(OFFER_CARD):
+            if await card.query_selector(FREE_SPAN):
+                continue
+            if wishlist_btn := await card.query_selector(MOVE_WISHLIST):
+                return wishlist_btn
+        return None
 
     async def _empty_cart(self, page: Page, wait_rerender: int = 30) -> bool | None:
-        has_paid_free = False
         try:
-            cards = await page.query_selector_all("//div[@data-testid='offer-card-layout-wrapper']")
-            for card in cards:
-                is_free = await card.query_selector("//span[text()='Free']")
-                if not is_free:
-                    has_paid_free = True
-                    wishlist_btn = await card.query_selector(
-                        "//button//span[text()='Move to wishlist']"
-                    )
-                    await wishlist_btn.click()
-
-            if has_paid_free and wait_rerender:
-                wait_rerender -= 1
+            # 每次移出一张卡片后购物车会重新渲染，因此逐个点击并重新查询
+            for _ in range(wait_rerender):
+                wishlist_btn = await self._find_paid_wishlist_btn(page)
+                if not wishlist_btn:
+                    return True
+                await wishlist_btn.click()
                 await page.wait_for_timeout(2000)
-                return await self._empty_cart(page, wait_rerender)
-            return True
-        except TimeoutError as err:
+
+            logger.warning("Paid games are still in the shopping cart")
+            return False
+        except PlaywrightError as err:
             logger.warning("Failed to empty shopping cart", err=err)
             return False
 
@@ -357,8 +585,8 @@ class EpicGames:
         logger.debug("Move ALL paid games from the shopping cart out")
         await self._empty_cart(self.page)
 
-        agent = AgentV(page=self.page, agent_config=settings)
-        await self.page.click("//button//span[text()='Check Out']")
+        agent = self._get_agent(self.page)
+        await self.page.click(CHECKOUT_BTN)
         await self._agree_license(self.page)
 
         try:
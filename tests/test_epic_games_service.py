@@ -0,0 +1,91 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+
+from services import epic_games_service
+from services.epic_games_service import get_promotions, URL_PRODUCT_BUNDLES, URL_PRODUCT_PAGE
+
+FREE_OFFER = {
+    "promotionalOffers": [{"promotionalOffers": [{"discountSetting": {"discountPercentage": 0}}]}]
+}
+PAID_OFFER = {
+    "promotionalOffers": [{"promotionalOffers": [{"discountSetting": {"discountPercentage": 50}}]}]
+}
+
+
+def _element(title: str, **kwargs) -> dict:
+    element = {
+        "title": title,
+        "id": f"id-{title}",
+        "namespace": f"ns-{title}",
+        "description": f"desc-{title}",
+        "offerType": "BASE_GAME",
+        "promotions": FREE_OFFER,
+        "categories": [{"path": "games"}],
+        "offerMappings": [],
+    }
+    element.update(kwargs)
+    return element
+
+
+def _run(monkeypatch, elements: list, cached: list | None = None) -> list:
+    payload = {"data": {"Catalog": {"searchStore": {"elements": elements}}}}
+    content = json.dumps(payload).encode()
+
+    async def fake_fetch():
+        return SimpleNamespace(content=content)
+
+    monkeypatch.setattr(epic_games_service, "_fetch_promotions", fake_fetch)
+    monkeypatch.setattr(
+        epic_games_service, "_write_promotions_cache", (cached if cached is not None else []).append
+    )
+    return asyncio.run(get_promotions())
+
+
+def test_get_promotions(monkeypatch):
+    elements = [
+        _element("page-game", offerMappings=[{"pageSlug": "page-game-slug"}], productSlug="x"),
+        _element("no-promotions", promotions=None),
+        _element("empty-offers", promotions={"promotionalOffers": []}),
+        _element("paid-game", promotions=PAID_OFFER),
+        _element("category-bundle", categories=[{"path": "bundles/games"}], productSlug="cb"),
+        _element("Ultimate Collection", offerMappings=[{"pageSlug": None}], urlSlug="uc"),
+        _element("no-slug", productSlug=None, urlSlug=""),
+    ]
+
+    cached = []
+    promotions = _run(monkeypatch, elements, cached)
+
+    assert {p.title: p.url for p in promotions} == {
+        "page-game": f"{URL_PRODUCT_PAGE}page-game-slug",
+        "category-bundle": f"{URL_PRODUCT_BUNDLES}cb",
+        "Ultimate Collection": f"{URL_PRODUCT_BUNDLES}uc",
+    }
+    assert promotions[0].namespace == "ns-page-game"
+    assert promotions[0].offerType == "BASE_GAME"
+
+    # promotions.json 缓存的是原始接口数据，不应包含解析时拼出的 url
+    (data,) = cached
+    assert all("url" not in e for e in data["data"]["Catalog"]["searchStore"]["elements"])
+
+
+def test_get_promotions_validates_malformed_element(monkeypatch):
+    constructed = []
+    model_construct = epic_games_service.PromotionGame.model_construct
+
+    def spy(**fields):
+        constructed.append(fields["title"])
+        return model_construct(**fields)
+
+    monkeypatch.setattr(epic_games_service.PromotionGame, "model_construct", spy)
+
+    promotions = _run(monkeypatch, [_element("trusted", productSlug="trusted")])
+    assert constructed == ["trusted"]
+    assert promotions[0].url == f"{URL_PRODUCT_PAGE}trusted"
+
+    with pytest.raises(ValidationError):
+        _run(monkeypatch, [_element("malformed", productSlug="malformed", description=42)])
+    assert constructed == ["trusted"]